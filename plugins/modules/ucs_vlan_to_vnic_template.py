@@ -16,6 +16,8 @@ module: ucs_vnic_template
 short_description: Configures vNIC templates on Cisco UCS Manager
 description:
 - Configures vNIC templates on Cisco UCS Manager.
+- Each module run sends its changes to UCS Manager in a single commit.
+- To change VLANs on many vNIC templates in one UCS Manager transaction, use templates_list rather than looping over this module.
 extends_documentation_fragment: cisco.ucs.ucs
 options:
   state:
@@ -30,7 +32,7 @@ options:
     - This name can be between 1 and 16 alphanumeric characters.
     - "You cannot use spaces or any special characters other than - (hyphen), \"_\" (underscore), : (colon), and . (period)."
     - You cannot change this name after the template is created.
-    required: yes
+    - Required unless templates_list is used.
   description:
     description:
     - A user-defined description of the vNIC template.
@@ -85,6 +87,7 @@ options:
   vlans_list:
     description:
     - List of VLANs used by the vNIC template.
+    - Each VLAN name can only appear once in the list.
     - "Each list element has the following suboptions:"
     - "= name"
     - "  The name of the VLAN (required)."
@@ -92,11 +95,29 @@ options:
     - "  Designates the VLAN as a native VLAN.  Only one VLAN in the list can be a native VLAN."
     - "  [choices: 'no', 'yes']"
     - "  [Default: 'no']"
+  templates_list:
+    description:
+    - List of vNIC templates to configure VLANs on in a single module run.
+    - Changes for all templates are sent to UCS Manager in one commit.
+    - Cannot be used with name or vlans_list.
+    - Each template name can only appear once in the list.
+    - "Each list element has the following suboptions:"
+    - "= name"
+    - "  The name of the vNIC template (required)."
+    - "= vlans_list"
+    - "  List of VLANs used by the vNIC template (required). Each VLAN name can only appear once."
+    - "  Each list element has the following suboptions:"
+    - "  = name"
+    - "    The name of the VLAN (required)."
+    - "  - native"
+    - "    Designates the VLAN as a native VLAN.  Only one VLAN in the list can be a native VLAN."
+    - "    [choices: 'no', 'yes']"
+    - "    [Default: 'no']"
     - "- state"
-    - "  If present, will verify VLAN is present on template."
-    - "  If absent, will verify VLAN is absent on template."
+    - "  If present, will verify the VLANs are present on the template."
+    - "  If absent, will verify the VLANs are absent on the template."
     - "  choices: [present, absent]"
-    - "  default: present"
+    - "  Default: the top-level state option."
   cdn_source:
     description:
     - CDN Source field.
@@ -166,7 +187,6 @@ EXAMPLES = r'''
     vlans_list:
     - name: default
       native: 'yes'
-      state: present
 
 - name: Remove vNIC template
   cisco.ucs.ucs_vnic_template:
@@ -194,101 +214,212 @@ EXAMPLES = r'''
     vlans_list:
     - name: default
       native: 'yes'
-      state: absent
+    state: absent
+
+- name: Configure VLANs on several vNIC templates in one commit
+  cisco.ucs.ucs_vlan_to_vnic_template:
+    hostname: 172.16.143.150
+    username: admin
+    password: password
+    templates_list:
+    - name: vNIC-A
+      vlans_list:
+      - name: default
+        native: 'yes'
+    - name: vNIC-B
+      vlans_list:
+      - name: default
+        native: 'yes'
 '''
 
 RETURN = r'''
-#
+diff:
+  description:
+  - VLANs on each vNIC template before and after the module run, keyed by template name.
+  - Each template maps VLAN names to their native setting.
+  - Templates that do not exist are reported with no VLANs.
+  returned: success
+  type: dict
+  sample:
+    before:
+      vNIC-A:
+        default: 'no'
+    after:
+      vNIC-A:
+        default: 'yes'
+        vlan-10: 'no'
 '''
 
-from ansible.module_utils.basic import AnsibleModule
+import re
+from collections import Counter
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
 from ansible_collections.cisco.ucs.plugins.module_utils.ucs import UCSModule, ucs_argument_spec
 
+try:
+    from ucsmsdk.mometa.vnic.VnicEtherIf import VnicEtherIf
+    from ucsmsdk.ucsexception import UcsException
+except ImportError:
+    # UCSModule reports the missing ucsmsdk when the module runs
+    VnicEtherIf = None
+    UcsException = Exception
+
+# UCS Manager VLAN names are 1 to 32 alphanumeric, -, _, : or . characters
+_VLAN_NAME_RE = re.compile(r'^[A-Za-z0-9_.:-]{1,32}\Z')
+
+def configure_vnic_template_vlans(ucs, module, template):
+    # queue the VLAN changes for one vNIC template on the login handle and return True if anything changed
+    handle = ucs.login_handle
+    # templates_list entries without their own state use the top-level state
+    state = template['state'] or module.params['state']
+    vlans = template['vlans_list'] or []
+    changed = False
+    # dn is <org_dn>/lan-conn-templ-<name>
+    dn = module.params['org_dn'] + '/lan-conn-templ-' + template['name']
+
+    # VLAN name -> native setting on the template, after is updated below as changes are planned
+    before = {}
+    after = {}
+    diff = ucs.result.setdefault('diff', dict(before={}, after={}))
+    diff['before'][template['name']] = before
+    diff['after'][template['name']] = after
+
+    mo = handle.query_dn(dn)
+    if not mo:
+        if state == 'absent':
+            # no template means there are no VLANs to remove from it
+            return False
+        # no template means no VLAN children either, so don't query for them
+        ucs.result['msg'] = dn + " vNIC template not configured in UCS. Use ucs_vnic_template module to create the template first"
+        module.fail_json(**ucs.result)
+
+    # query all VLAN interfaces of the template in one request instead of one query_dn per VLAN
+    children = handle.query_children(in_dn=dn, class_id='VnicEtherIf') or []
+    vlan_mos = {child.name: child for child in children}
+
+    before.update((name, vlan_mo.default_net) for name, vlan_mo in vlan_mos.items())
+    after.update(before)
+
+    if state == 'absent':
+        # only remove the listed VLANs that are actually on the template
+        any_removed = False
+        for vlan in vlans:
+            mo_1 = vlan_mos.get(vlan['name'])
+            if mo_1:
+                if not module.check_mode:
+                    handle.remove_mo(mo_1)
+                del after[vlan['name']]
+                any_removed = True
+        if any_removed:
+            changed = True
+    else:
+        # check vlan props and only queue the VLANs that are missing or differ
+        to_add = []
+        for vlan in vlans:
+            mo_1 = vlan_mos.get(vlan['name'])
+            if mo_1:
+                if mo_1.default_net != vlan['native']:
+                    to_add.append(vlan)
+            else:
+                to_add.append(vlan)
+        for vlan in to_add:
+            after[vlan['name']] = vlan['native']
+
+        changed = bool(to_add)
+        if not changed or module.check_mode:
+            # nothing to queue, or check mode where no MOs need to be built
+            return changed
+
+        # build the full child set first, then attach it and send it with the template in one add_mo
+        vlan_children = [VnicEtherIf(dn, vlan['name'], default_net=vlan['native']) for vlan in to_add]
+        for mo_1 in vlan_children:
+            mo.child_add(mo_1)
+        handle.add_mo(mo, True)
+
+    return changed
+
 
 def main():
+    vlan_spec = dict(
+        name=dict(type='str', required=True),
+        native=dict(type='str', choices=['yes', 'no'], default='no'),
+    )
     argument_spec = ucs_argument_spec
     argument_spec.update(
         org_dn=dict(type='str', default='org-root'),
-        name=dict(type='str', required=True),
-        vlans_list=dict(type='list', elements='dict', options=dict(
-          name=dict(type='str', required=True),
-          native=dict(type='str', choices=['yes', 'no'], default='no')
-        ), required=True),
+        name=dict(type='str'),
+        vlans_list=dict(type='list', elements='dict', options=vlan_spec),
         state=dict(type='str', default='present', choices=['present', 'absent']),
+        templates_list=dict(type='list', elements='dict', options=dict(
+            name=dict(type='str', required=True),
+            vlans_list=dict(type='list', elements='dict', options=vlan_spec, required=True),
+            state=dict(type='str', choices=['present', 'absent']),
+        )),
     )
 
     module = AnsibleModule(
         argument_spec,
         supports_check_mode=True,
+        required_one_of=[
+            ['name', 'templates_list'],
+        ],
+        mutually_exclusive=[
+            ['name', 'templates_list'],
+            ['vlans_list', 'templates_list'],
+        ],
+        required_together=[
+            ['name', 'vlans_list'],
+        ],
     )
-    ucs = UCSModule(module)
-
-    err = False
+    templates = module.params['templates_list'] or [module.params]
+    # a template listed twice would have its first set of changes replaced in the commit buffer
+    name_counts = Counter(template['name'] for template in templates)
+    duplicates = sorted(name for name, count in name_counts.items() if count > 1)
+    if duplicates:
+        module.fail_json(msg="duplicate vNIC template names in templates_list: %s" % ', '.join(duplicates))
+    # reject invalid VLAN names before any request is sent to UCS Manager
+    for template in templates:
+        for vlan in template['vlans_list'] or []:
+            if not _VLAN_NAME_RE.match(vlan['name']):
+                module.fail_json(msg="invalid VLAN name: %s" % vlan['name'])
+        # a VLAN listed twice is ambiguous and would be removed or queued twice
+        vlan_counts = Counter(vlan['name'] for vlan in template['vlans_list'] or [])
+        duplicates = sorted(name for name, count in vlan_counts.items() if count > 1)
+        if duplicates:
+            module.fail_json(msg="duplicate VLAN names for vNIC template %s: %s" % (template['name'], ', '.join(duplicates)))
+    if not any(template['vlans_list'] for template in templates):
+        # nothing to configure, so don't open a session to UCS Manager at all
+        module.exit_json(changed=False, diff=dict(before={}, after={}))
 
-    # UCSModule creation above verifies ucsmsdk is present and exits on failure.  Additional imports are done below.
-    from ucsmsdk.mometa.vnic.VnicEtherIf import VnicEtherIf
+    ucs = UCSModule(module)
+    if VnicEtherIf is None:
+        module.fail_json(msg=missing_required_lib('ucsmsdk'))
+    # all queries and the commit below go through this single logged in session
+    handle = ucs.login_handle
+    result = ucs.result
+    if not handle.cookie:
+        result['msg'] = "login to UCS Manager did not return a session cookie"
+        module.fail_json(**result)
 
     changed = False
-    try:
-        mo_exists = False
-        props_match = False
-        # dn is <org_dn>/lan-conn-templ-<name>
-        dn = module.params['org_dn'] + '/lan-conn-templ-' + module.params['name']
-
-        mo = ucs.login_handle.query_dn(dn)
-        if mo:
-            mo_exists = True
-
-        if module.params['state'] == 'absent':
-            # mo must exist but all properties do not have to match
-            if mo_exists:
-                if not module.check_mode:
-                    for vlan in module.params['vlans_list']:
-                        child_dn = dn + '/if-' + str(vlan['name'])
-                        mo_1 = ucs.login_handle.query_dn(child_dn)
-                        ucs.login_handle.remove_mo(mo_1)
-                    ucs.login_handle.commit()
-                changed = True
-        else:
-          # check vlan props
-            for vlan in module.params['vlans_list']:
-                child_dn = dn + '/if-' + str(vlan['name'])
-                mo_1 = ucs.login_handle.query_dn(child_dn)
-                if module.params['state'] == 'absent':
-                    if mo_1:
-                        props_match = False
-                        break
-                else:
-                    if mo_1:
-                        kwargs = dict(default_net=vlan['native'])
-                        if mo_1.check_prop_match(**kwargs):
-                            props_match = True
-                    else:
-                        props_match = False
-                        break
-
-            if not props_match:
-                if not module.check_mode:
-                    if module.params.get('vlans_list'):
-                        for vlan in module.params['vlans_list']:
-                            mo_1 = VnicEtherIf(
-                                parent_mo_or_dn=mo,
-                                name=str(vlan['name']),
-                                default_net=vlan['native'],
-                                )
-
-                    ucs.login_handle.add_mo(mo, True)
-                    ucs.login_handle.commit()
+    for template in templates:
+        try:
+            if configure_vnic_template_vlans(ucs, module, template):
                 changed = True
+        except UcsException as e:
+            result['msg'] = "setup error: %s " % str(e)
+            module.fail_json(**result)
 
-    except Exception as e:
-        err = True
-        ucs.result['msg'] = "setup error: %s " % str(e)
+    # changes for all templates are sent to UCS Manager in a single commit
+    if changed and not module.check_mode:
+        try:
+            handle.commit()
+        except UcsException as e:
+            result['msg'] = "commit error: %s " % str(e)
+            module.fail_json(**result)
 
-    ucs.result['changed'] = changed
-    if err:
-        module.fail_json(**ucs.result)
-    module.exit_json(**ucs.result)
+    result['changed'] = changed
+    module.exit_json(**result)
 
 
 if __name__ == '__main__':